@@ -1,3 +1,9 @@
+import os
+import tempfile
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
 
 
 class GoogleSheets:
@@ -5,3 +11,12 @@ class GoogleSheets:
     id_for_testing = '12mACZj1tFFRoRPp8TQjy-yY610JY84zG73O1yzULJWI'
     name_contains = 'SEO Content'
     range = 'A1:J'  # open-ended range forces Google API to return range up to last non-empty row
+    scopes = ['https://www.googleapis.com/auth/drive',
+              'https://www.googleapis.com/auth/spreadsheets',
+              ]
+    token_refresh_margin = 300  # seconds before expiry at which the access token is refreshed proactively
+    # note: the temp dir is empty at the start of every AWS Batch job.
+    # for cache hits across runs and jobs, point GOOGLE_SHEETS_CACHE_DIR to a persistent mount (e.g. EFS).
+    cache_dir = Path(os.getenv('GOOGLE_SHEETS_CACHE_DIR',
+                               Path(tempfile.gettempdir()) / 'datascience_batch_job_utils' / 'sheets'))
+    cache_max_bytes = 256 * 1024 * 1024  # least-recently used entries are evicted above this size
@@ -1,12 +1,24 @@
 import os
-from typing import Optional
+import io
+import time
+import datetime
+import atexit
+import shutil
+import tempfile
+from logging import Logger
+from pathlib import Path
+from typing import Optional, Callable, List
+import pandas as pd
+import pyarrow as pa
 from dotenv import load_dotenv
 from sqlalchemy.engine import Engine
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 import snowflake.connector
 from snowflake.connector import SnowflakeConnection
 
 from datascience_batch_job_utils.utils import is_inside_aws
+from datascience_batch_job_utils.utils import to_sql_safe_list
+from datascience_batch_job_utils.helpers import query_stats_collector
 
 load_dotenv()
 
@@ -18,7 +30,7 @@ def get_sql_alchemy_engine(db: str,
     assert os.getenv('snowflake_un') is not None
     assert os.getenv('snowflake_pw') is not None
 
-    return create_engine(
+    engine = create_engine(
         'snowflake://{user_name}:{password}@{account}/{database}/{schema}?role={role}&warehouse='
         '{warehouse}'.format(
             user_name=os.getenv('snowflake_un'),
@@ -31,6 +43,23 @@ def get_sql_alchemy_engine(db: str,
         )
     )
 
+    # record query IDs and client-side timings of all statements executed with this engine
+    event.listen(engine, 'before_cursor_execute', _start_query_timer)
+    event.listen(engine, 'after_cursor_execute', _record_query)
+
+    return engine
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start_time'].pop()
+    query_stats_collector.add(query_id=getattr(cursor, 'sfqid', None),
+                              client_seconds=time.time() - start,
+                              )
+
 
 def get_snowflake_connector_connection(db: str = 'pattern_db',
                                        schema: Optional[str] = None,
@@ -72,7 +101,227 @@ def snowflake_query_string(query: str,
 
     ctx = get_snowflake_connector_connection(db=db, schema=schema)
     try:
-        query_results_cursors = ctx.execute_string(query)
+        # execute statements one by one, to record the client-side timing of each
+        query_results_cursors = []
+        start = time.time()
+        for cursor in ctx.execute_stream(io.StringIO(query)):
+            query_stats_collector.add(query_id=cursor.sfqid,
+                                      client_seconds=time.time() - start,
+                                      )
+            query_results_cursors.append(cursor)
+            start = time.time()
         return query_results_cursors
     finally:
-        ctx.close()
\ No newline at end of file
+        ctx.close()
+
+
+# scratch directories holding spilled query results. they are removed when the job (i.e. the process) ends.
+_scratch_dirs = {}
+
+
+@atexit.register
+def remove_scratch_dirs() -> None:
+    for path in _scratch_dirs.values():
+        shutil.rmtree(path, ignore_errors=True)
+    _scratch_dirs.clear()
+
+
+def get_scratch_dir(parent: Optional[Path] = None,
+                    ) -> Path:
+    if parent not in _scratch_dirs:
+        _scratch_dirs[parent] = Path(tempfile.mkdtemp(prefix='datascience_batch_job_utils_', dir=parent))
+    return _scratch_dirs[parent]
+
+
+def widen_integer_fields(schema: pa.Schema,
+                         ) -> pa.Schema:
+    """
+    use int64 for all signed integer fields.
+
+    note: Snowflake picks the integer width of each result batch based on the values in it,
+    so the first batch may use e.g. int8 for a column that requires int16 in a later batch.
+    """
+
+    return pa.schema([field.with_type(pa.int64()) if pa.types.is_signed_integer(field.type) else field
+                      for field in schema],
+                     metadata=schema.metadata,
+                     )
+
+
+def snowflake_query_to_arrow(query: str,
+                             db='PATTERN_DB',
+                             schema: Optional[str] = None,
+                             spill_to_disk: bool = False,
+                             scratch_dir: Optional[Path] = None,
+                             ) -> pa.Table:
+    """
+    run a single query and return the results as an Arrow table.
+
+    if spill_to_disk is True, results are streamed batch by batch into an Arrow IPC file on local scratch disk,
+    and the returned table is a zero-copy view on the memory-mapped file.
+    columns are only paged into memory when they are accessed, so results larger than RAM can be scanned and filtered.
+    use table.to_pandas() on a selection of columns or a filtered table to materialize only what is needed.
+
+    note: spilled files are removed when the process ends.
+    """
+
+    ctx = get_snowflake_connector_connection(db=db, schema=schema)
+    try:
+        start = time.time()
+        cursor = ctx.cursor()
+        cursor.execute(query)
+
+        if not spill_to_disk:
+            table = cursor.fetch_arrow_all()
+        else:
+            fd, path = tempfile.mkstemp(suffix='.arrow', dir=get_scratch_dir(scratch_dir))
+            os.close(fd)
+            writer = None
+            try:
+                for batch in cursor.fetch_arrow_batches():
+                    if writer is None:
+                        file_schema = widen_integer_fields(batch.schema)
+                        writer = pa.ipc.new_file(path, file_schema)
+                    # batches may come with different integer widths, so cast every batch to the widest width
+                    if batch.schema != file_schema:
+                        batch = batch.cast(file_schema)
+                    writer.write_table(batch)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+            if writer is None:  # no rows
+                table = None
+            else:
+                table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+        # empty results do not come with a schema
+        if table is None:
+            table = pa.table({col.name: pa.array([], type=pa.null()) for col in cursor.description})
+
+        query_stats_collector.add(query_id=cursor.sfqid,
+                                  client_seconds=time.time() - start,
+                                  )
+
+        return table
+    finally:
+        ctx.close()
+
+
+QUERY_STATS_COLUMNS = ['query_id', 'warehouse_name', 'queued_seconds', 'compilation_seconds', 'execution_seconds',
+                       'bytes_scanned', 'bytes_spilled_local', 'bytes_spilled_remote']
+
+
+def fetch_query_stats(query_ids: List[str],
+                      start_time: datetime.datetime,
+                      db='PATTERN_DB',
+                      schema: Optional[str] = None,
+                      chunk_size: int = 1000,
+                      ) -> pd.DataFrame:
+    """
+    get server-side statistics of queries by their IDs, in as few round trips as possible.
+
+    note: QUERY_HISTORY returns at most 10,000 queries of the current user.
+    only queries that ended after start_time are searched, so that queries of other jobs using the same user
+    do not push the queries of this job out of the result.
+    """
+
+    columns = QUERY_STATS_COLUMNS
+    if not query_ids:
+        return pd.DataFrame(columns=columns)
+
+    ctx = get_snowflake_connector_connection(db=db, schema=schema)
+    try:
+        rows = []
+        for i in range(0, len(query_ids), chunk_size):
+            cursor = ctx.cursor()
+            cursor.execute(f"""
+                select query_id,
+                       warehouse_name,
+                       (queued_provisioning_time + queued_repair_time + queued_overload_time) / 1000,
+                       compilation_time / 1000,
+                       execution_time / 1000,
+                       bytes_scanned,
+                       bytes_spilled_to_local_storage,
+                       bytes_spilled_to_remote_storage
+                from table(information_schema.query_history(
+                    end_time_range_start => to_timestamp_ltz({start_time.timestamp():.3f}),
+                    result_limit => 10000))
+                where query_id in {to_sql_safe_list(query_ids[i:i + chunk_size])}
+            """)
+            rows.extend(cursor.fetchall())
+    finally:
+        ctx.close()
+
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    for col in columns[2:]:
+        df[col] = pd.to_numeric(df[col])
+
+    return df
+
+
+def log_query_report(logger: Logger,
+                     stats_source: Callable[[List[str], datetime.datetime], pd.DataFrame] = fetch_query_stats,
+                     outlier_factor: float = 3.0,
+                     min_outlier_seconds: float = 10.0,
+                     max_queued_seconds: float = 30.0,
+                     clear: bool = True,
+                     ) -> pd.DataFrame:
+    """
+    log client-side timings and server-side statistics of every query recorded during the job, and warn about outliers.
+
+    a query is an outlier if
+    - it took outlier_factor times longer than the median query (and at least min_outlier_seconds), or
+    - it was queued for longer than max_queued_seconds, or
+    - it spilled to remote storage.
+
+    stats_source maps a list of query IDs and the start time of the earliest query
+    to a dataframe with the columns returned by fetch_query_stats.
+    if server-side statistics cannot be fetched, only client-side timings are logged.
+    """
+
+    records = query_stats_collector.records
+    if not records:
+        logger.info('No SQL queries were recorded.')
+        return pd.DataFrame()
+
+    df_client = pd.DataFrame.from_records(records)
+    try:
+        df_server = stats_source(df_client['query_id'].tolist(), df_client['start_time'].min())
+    except Exception as ex:  # the report must not fail a job that otherwise succeeded
+        logger.warning(f'Could not fetch server-side query statistics. {type(ex).__name__}: {ex}')
+        df_server = pd.DataFrame(columns=QUERY_STATS_COLUMNS)
+    df = df_client.merge(df_server, on='query_id', how='left')
+
+    median_seconds = df['client_seconds'].median()
+    df['is_outlier'] = False
+
+    logger.info(f'Query report for {len(df)} queries (median client-side time {median_seconds:.1f} seconds):')
+    for idx, row in df.iterrows():
+        msg = f'Query {row["query_id"]} ({row["label"] or "unlabeled"}): ' \
+              f'client {row["client_seconds"]:.1f}s, ' \
+              f'queued {row["queued_seconds"]:.1f}s, ' \
+              f'compilation {row["compilation_seconds"]:.1f}s, ' \
+              f'execution {row["execution_seconds"]:.1f}s, ' \
+              f'scanned {row["bytes_scanned"] / 1024 ** 2:,.1f} MBs, ' \
+              f'spilled {row["bytes_spilled_local"] / 1024 ** 2:,.1f} MBs locally ' \
+              f'and {row["bytes_spilled_remote"] / 1024 ** 2:,.1f} MBs remotely'
+
+        reasons = []
+        if row['client_seconds'] > max(outlier_factor * median_seconds, min_outlier_seconds):
+            reasons.append(f'took more than {outlier_factor}x the median')
+        if row['queued_seconds'] > max_queued_seconds:
+            reasons.append(f'was queued for more than {max_queued_seconds}s')
+        if row['bytes_spilled_remote'] > 0:
+            reasons.append('spilled to remote storage')
+
+        if reasons:
+            df.loc[idx, 'is_outlier'] = True
+            logger.warning(f'{msg}. Outlier: {", ".join(reasons)}.')
+        else:
+            logger.info(msg)
+
+    if clear:
+        query_stats_collector.clear()
+
+    return df
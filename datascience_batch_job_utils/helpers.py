@@ -1,4 +1,9 @@
+import time
+import datetime
 import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
 
 
 class RecordCollector(logging.Handler):
@@ -8,4 +13,92 @@ class RecordCollector(logging.Handler):
         self.name = 'collector'
 
     def emit(self, record):
-        self.records.append(record)
\ No newline at end of file
+        self.records.append(record)
+
+
+class QueryStatsCollector:
+    """
+    collects IDs and client-side timings of SQL queries executed during a job.
+
+    note: server-side statistics are fetched for the collected IDs at the end of the job.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._label = ContextVar('query_label', default=None)
+
+    def add(self,
+            query_id: Optional[str],
+            client_seconds: float,
+            label: Optional[str] = None,
+            ):
+        if query_id is None:  # e.g. statement was not executed by Snowflake
+            return
+        start_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=client_seconds)
+        self.records.append({'query_id': query_id,
+                             'label': label or self._label.get(),
+                             'start_time': start_time,
+                             'client_seconds': client_seconds,
+                             })
+
+    @contextmanager
+    def label(self, name: str):
+        """
+        attribute all queries executed inside this context to name (e.g. the function that runs them).
+        """
+        token = self._label.set(name)
+        try:
+            yield
+        finally:
+            self._label.reset(token)
+
+    def clear(self):
+        self.records = []
+
+
+query_stats_collector = QueryStatsCollector()
+
+
+class QueryRecordingCursor:
+    """
+    wraps a Snowflake cursor, so that the ID and client-side timing of every statement executed with it are recorded.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        start = time.time()
+        res = self._cursor.execute(*args, **kwargs)
+        query_stats_collector.add(query_id=self._cursor.sfqid,
+                                  client_seconds=time.time() - start,
+                                  )
+        return res
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._cursor.__exit__(*exc_info)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class QueryRecordingConnection:
+    """
+    wraps a Snowflake connection, so that statements executed with its cursors are recorded.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return QueryRecordingCursor(self._connection.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
@@ -1,12 +1,22 @@
 import os
+import gzip
+import json
 import time
+import hashlib
+import datetime
 import itertools
+import threading
+from functools import lru_cache
+from pathlib import Path
 from ratelimit import limits, sleep_and_retry
 from ssl import SSLError
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Optional, Callable
 import pandas as pd
+import google_auth_httplib2
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document, Resource
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import build_http
 from googleapiclient.errors import HttpError
 from google.auth.exceptions import TransportError
 
@@ -37,13 +47,188 @@ def get_google_auth_credentials() -> Credentials:
     return creds
 
 
+@lru_cache(maxsize=None)
+def get_discovery_document(api: str,
+                           version: str,
+                           ) -> str:
+    """
+    load the discovery document shipped with googleapiclient, and read it only once per process.
+
+    note: this avoids fetching the discovery document over the network every time a client is built.
+    the raw JSON string is cached, because build_from_document modifies the parsed document in place,
+    and threads must not share it.
+    """
+
+    doc = get_static_doc(api, version)
+    if doc is None:
+        raise ValueError(f'No offline discovery document found for api="{api}" and version="{version}".')
+
+    return doc
+
+
+class GoogleClientRegistry:
+    """
+    process-wide registry of Google API clients.
+
+    one credentials object is shared by all clients, and its access token is refreshed shortly before it expires.
+    each thread gets its own clients, because httplib2.Http objects are not thread-safe.
+    note: build_http sets a socket timeout, so that a stalled connection raises TimeoutError instead of hanging.
+    """
+
+    def __init__(self,
+                 refresh_margin: int = configs.GoogleSheets.token_refresh_margin,
+                 ):
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self._creds: Optional[Credentials] = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_credentials(self) -> Credentials:
+        with self._lock:
+            if self._creds is None:
+                # authenticate by looking for private key in environment variables
+                self._creds = get_google_auth_credentials().with_scopes(configs.GoogleSheets.scopes)
+
+            # refresh proactively, so that no request has to wait for (or fail on) an expired token
+            if self._creds.token is None or self._creds.expiry is None or \
+                    self._creds.expiry - datetime.datetime.utcnow() < self.refresh_margin:
+                self._creds.refresh(google_auth_httplib2.Request(build_http()))
+
+            return self._creds
+
+    def get_service(self,
+                    api: str,
+                    version: str,
+                    ) -> Resource:
+        creds = self.get_credentials()
+
+        if not hasattr(self._local, 'services'):
+            self._local.services = {}
+
+        key = (api, version)
+        if key not in self._local.services:
+            http = google_auth_httplib2.AuthorizedHttp(creds, http=build_http())
+            self._local.services[key] = build_from_document(get_discovery_document(api, version), http=http)
+
+        return self._local.services[key]
+
+    def clear(self) -> None:
+        """
+        drop the credentials and the clients of all threads, e.g. after the private key was rotated.
+        """
+        with self._lock:
+            self._creds = None
+        self._local = threading.local()
+
+
+google_client_registry = GoogleClientRegistry()
+
+
+class SheetValuesCache:
+    """
+    local cache of values downloaded from Google Sheets, keyed by spreadsheet ID and range.
+
+    each entry is stored as gzip-compressed JSON, together with the revision of the spreadsheet at download time.
+    least-recently used entries are evicted once the total size of the cache exceeds max_bytes.
+    """
+
+    def __init__(self,
+                 cache_dir: Path = configs.GoogleSheets.cache_dir,
+                 max_bytes: int = configs.GoogleSheets.cache_max_bytes,
+                 ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def get_path(self,
+                 spreadsheet_id: str,
+                 spreadsheet_range: str,
+                 ) -> Path:
+        key = hashlib.sha256(f'{spreadsheet_id}:{spreadsheet_range}'.encode()).hexdigest()
+        return self.cache_dir / f'{key}.json.gz'
+
+    def get(self,
+            spreadsheet_id: str,
+            spreadsheet_range: str,
+            revision: str,
+            ) -> Optional[List[List]]:
+        """
+        return cached values, or None if there is no entry or the spreadsheet was modified since it was cached.
+        """
+
+        path = self.get_path(spreadsheet_id, spreadsheet_range)
+        with self._lock:
+            try:
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    entry = json.load(f)
+                is_current = entry['revision'] == revision
+            except FileNotFoundError:
+                return None
+            except (OSError, EOFError, ValueError, KeyError):  # corrupt entry
+                path.unlink(missing_ok=True)
+                return None
+
+            if not is_current:
+                return None
+
+            os.utime(path)  # mark as recently used
+            return entry['values']
+
+    def put(self,
+            spreadsheet_id: str,
+            spreadsheet_range: str,
+            revision: str,
+            values: List[List],
+            ) -> None:
+
+        entry = {'spreadsheet_id': spreadsheet_id,
+                 'range': spreadsheet_range,
+                 'revision': revision,
+                 'values': values,
+                 }
+
+        path = self.get_path(spreadsheet_id, spreadsheet_range)
+        with self._lock:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first, so that readers never see a partially written entry
+            path_tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            with gzip.open(path_tmp, 'wt', encoding='utf-8') as f:
+                json.dump(entry, f, separators=(',', ':'))
+            os.replace(path_tmp, path)
+
+            self._evict()
+
+    def _evict(self) -> None:
+        paths = []
+        for path in self.cache_dir.glob('*.json.gz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            paths.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in paths)
+        for _, size, path in sorted(paths):
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in self.cache_dir.glob('*.json.gz'):
+                path.unlink(missing_ok=True)
+
+
+sheet_values_cache = SheetValuesCache()
+
+
 def get_name2spreadsheet_id() -> Dict[str, str]:
     """
     get IDs and names of Google sheet containing SEO Content
     """
 
-    creds = get_google_auth_credentials()  # authenticate by looking for private key in environment variables
-    service = build('drive', 'v3', credentials=creds)
+    service = google_client_registry.get_service('drive', 'v3')
 
     results = service.files().list(
         q=f'name contains "{configs.GoogleSheets.name_contains}"',
@@ -65,9 +250,7 @@ def get_name2sheet_id(spreadsheet_id: str,
     a sheet is a tab within a spreadsheet. each sheet has its own unique name and ID
     """
 
-    # authenticate by looking for private key in environment variables
-    creds = get_google_auth_credentials()
-    service = build('sheets', 'v4', credentials=creds)
+    service = google_client_registry.get_service('sheets', 'v4')
     service_spreadsheets = service.spreadsheets()
 
     # get information about the spreadsheet
@@ -82,27 +265,90 @@ def get_name2sheet_id(spreadsheet_id: str,
     return res
 
 
+def get_spreadsheet_revision(spreadsheet_id: str,
+                             max_num_retry: int = 3,
+                             ) -> str:
+    """
+    get a string that changes whenever the spreadsheet is edited.
+
+    note: this is a Drive API request, and does not count towards the read quota of the Sheets API.
+    """
+
+    service = google_client_registry.get_service('drive', 'v3')
+    http_request = service.files().get(fileId=spreadsheet_id, fields='modifiedTime, version')
+    result = execute_request_with_retry(http_request,
+                                        max_num_retry=max_num_retry,
+                                        execute=lambda r: r.execute(),  # not subject to the Sheets API rate-limit
+                                        )
+
+    return f'{result["version"]}:{result["modifiedTime"]}'
+
+
 def get_values_from_google_sheet(spreadsheet_range: str,
                                  spreadsheet_id: str,
                                  max_num_retry: int = 3,
                                  verbose: bool = False,
+                                 use_cache: bool = False,
+                                 force_refresh: bool = False,
                                  ) -> List[List]:
+    """
+    get values from a range in a Google Sheet.
+
+    if use_cache is True, values are only downloaded if the spreadsheet was modified since they were last cached.
+    use force_refresh to download and re-cache values regardless.
+    """
+
+    revision = None
+    if use_cache:
+        revision = get_spreadsheet_revision(spreadsheet_id, max_num_retry=max_num_retry)
+        if not force_refresh:
+            res = sheet_values_cache.get(spreadsheet_id, spreadsheet_range, revision)
+            if res is not None:
+                if verbose:
+                    print(f'Using cached values from spreadsheet with range={spreadsheet_range}')
+                return res
+
     if verbose:
         print(f'Getting values from spreadsheet with range={spreadsheet_range}')
 
-    # authenticate by looking for private key in environment variables
-    creds = get_google_auth_credentials()
-    service = build('sheets', 'v4', credentials=creds)
+    service = google_client_registry.get_service('sheets', 'v4')
     service_spreadsheets = service.spreadsheets()
 
     http_get_request = service_spreadsheets.values().get(spreadsheetId=spreadsheet_id, range=spreadsheet_range)
 
+    result = execute_request_with_retry(http_get_request, max_num_retry=max_num_retry)
+
+    try:
+        res = result['values']
+    except KeyError:  # empty range
+        print(f'Did not find values in spreadsheet with range {spreadsheet_range}.')
+        res = []
+
+    if use_cache:
+        sheet_values_cache.put(spreadsheet_id, spreadsheet_range, revision, res)
+
+    return res
+
+
+def execute_request_with_retry(http_request,
+                               max_num_retry: int = 3,
+                               execute: Optional[Callable] = None,
+                               ):
+    """
+    execute a request, and retry on transient network errors.
+
+    by default, requests are executed with the rate-limit of the Sheets API.
+    """
+
+    if execute is None:
+        execute = execute_request_with_rate_limit
+
     result = False
     retry = 0
     while not result:
         retry += 1
         try:
-            result = execute_request_with_rate_limit(http_get_request)
+            result = execute(http_request)
         except SSLError as ex:
             if retry < max_num_retry:
                 print(f'Encountered {ex}. Waiting 1s and then retrying.')
@@ -115,6 +361,8 @@ def get_values_from_google_sheet(spreadsheet_range: str,
                 print(f'Encountered {ex}. Waiting 1s and then retrying.')
                 print(retry, max_num_retry)
                 time.sleep(1)
+            else:
+                raise ex
         except TimeoutError as ex:
             if retry < max_num_retry:
                 print(f'Encountered {ex}. Waiting 1s and then retrying.')
@@ -125,13 +373,7 @@ def get_values_from_google_sheet(spreadsheet_range: str,
         except Exception as ex:
             raise ex
 
-    try:
-        res = result['values']
-    except KeyError:  # empty range
-        print(f'Did not find values in spreadsheet with range {spreadsheet_range}.')
-        return []
-    else:
-        return res
+    return result
 
 
 # note: Google API read rate-limit is 60 per user per minute
@@ -147,6 +389,8 @@ def read_from_google_sheets(spreadsheet_id: str,
                             column_name2variations: Dict[str, List[str]],
                             row_idx_with_column_names: int = 2,  # 3rd row
                             start_row: int = 4,  # in which row does the data start?
+                            use_cache: bool = False,
+                            force_refresh: bool = False,
                             ) -> pd.DataFrame:
     """
     get data from Google Sheet.
@@ -162,7 +406,10 @@ def read_from_google_sheets(spreadsheet_id: str,
     # get values from Google sheet
     try:
         gs_values = get_values_from_google_sheet(spreadsheet_range=configs.GoogleSheets.range,
-                                                 spreadsheet_id=spreadsheet_id)
+                                                 spreadsheet_id=spreadsheet_id,
+                                                 use_cache=use_cache,
+                                                 force_refresh=force_refresh,
+                                                 )
     except HttpError:  # sheet cannot be found
         raise NoGoogleSheetFound(brand=brand)
 
@@ -14,11 +14,13 @@ import psutil
 import pytz
 import boto3
 from dotenv import load_dotenv
-from snowflake.connector.pandas_tools import pd_writer
+from snowflake.connector.pandas_tools import write_pandas
 from sqlalchemy.engine import Engine
 import pybrake
 
 from datascience_batch_job_utils.helpers import RecordCollector
+from datascience_batch_job_utils.helpers import query_stats_collector
+from datascience_batch_job_utils.helpers import QueryRecordingConnection
 from datascience_batch_job_utils.exceptions import EmptyQueryResults
 
 
@@ -69,13 +71,36 @@ def push_to_snowflake(engine: Engine,
               con=engine,
               if_exists=if_exists,
               index=False,
-              method=pd_writer,
+              method=pd_writer_with_query_stats,
               chunksize=16384,  # otherwise, error if too much data is pushed
               )
 
     df.columns = df.columns.str.lower()
 
 
+def pd_writer_with_query_stats(table,
+                               conn,
+                               keys,
+                               data_iter,
+                               **kwargs,
+                               ) -> None:
+    """
+    same as pd_writer, but records IDs and client-side timings of the statements run by write_pandas.
+
+    note: pd_writer runs write_pandas on the raw connector connection, which bypasses the SQLAlchemy engine events.
+    note: every statement that write_pandas runs with cursor.execute is recorded (e.g. CREATE STAGE and COPY INTO).
+    with snowflake-connector-python 3.0 (see requirements), this includes the PUT that uploads the data.
+    newer connectors upload files without running a SQL statement, so there is no query ID to record for the upload.
+    """
+
+    write_pandas(conn=QueryRecordingConnection(conn.connection.connection),
+                 df=pd.DataFrame(data_iter, columns=keys),
+                 table_name=table.name.upper(),  # SQLAlchemy creates tables case-insensitively, i.e. upper-cased
+                 schema=table.schema,
+                 **kwargs,
+                 )
+
+
 def get_logger(name: Optional[str] = None,
                level: int = logging.INFO,
                log_file_path: Optional[Path] = None,
@@ -277,7 +302,9 @@ def raise_exception_if_empty(fn: Callable[QueryFnInp, pd.DataFrame],
         if verbose:
             print(f'Started SQL query: {fn.__name__}')
 
-        df: pd.DataFrame = fn(*args, **kwargs)
+        # attribute queries to the decorated function in the query report
+        with query_stats_collector.label(fn.__name__):
+            df: pd.DataFrame = fn(*args, **kwargs)
 
         if verbose:
             print(f'Completed SQL query: {fn.__name__} in {time.time() - start} seconds')
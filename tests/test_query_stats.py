@@ -0,0 +1,166 @@
+import logging
+import datetime
+import pandas as pd
+import pytest
+
+from datascience_batch_job_utils.helpers import query_stats_collector
+from datascience_batch_job_utils.helpers import QueryRecordingConnection
+from datascience_batch_job_utils.utils import raise_exception_if_empty
+from datascience_batch_job_utils.connections import log_query_report
+from datascience_batch_job_utils.connections import QUERY_STATS_COLUMNS
+
+
+logger = logging.getLogger('test_query_stats')
+
+
+@pytest.fixture(autouse=True)
+def empty_collector():
+    query_stats_collector.clear()
+    yield
+    query_stats_collector.clear()
+
+
+def make_stats_source(query_id2stats):
+    """
+    stand-in for fetch_query_stats, returning server-side statistics only for the given query IDs.
+    """
+
+    def stats_source(query_ids, start_time):
+        rows = [{'query_id': query_id,
+                 'warehouse_name': 'TEST_WH',
+                 'queued_seconds': 0.0,
+                 'compilation_seconds': 0.1,
+                 'execution_seconds': 1.0,
+                 'bytes_scanned': 1024,
+                 'bytes_spilled_local': 0,
+                 'bytes_spilled_remote': 0,
+                 **query_id2stats[query_id],
+                 }
+                for query_id in query_ids if query_id in query_id2stats]
+        return pd.DataFrame.from_records(rows, columns=QUERY_STATS_COLUMNS)
+
+    return stats_source
+
+
+def test_raise_exception_if_empty_labels_queries():
+
+    @raise_exception_if_empty
+    def get_asins():
+        query_stats_collector.add(query_id='q1', client_seconds=1.0)
+        return pd.DataFrame({'asin': ['B000000001']})
+
+    get_asins()
+    query_stats_collector.add(query_id='q2', client_seconds=1.0)
+
+    assert [r['label'] for r in query_stats_collector.records] == ['get_asins', None]
+
+
+def test_recording_connection_records_executed_statements():
+
+    class FakeCursor:
+        sfqid = None
+        rowcount = 1
+
+        def execute(self, query):
+            self.sfqid = f'id of {query}'
+            return self
+
+    class FakeConnection:
+        session_id = 123
+
+        def cursor(self):
+            return FakeCursor()
+
+    connection = QueryRecordingConnection(FakeConnection())
+    cursor = connection.cursor()
+    cursor.execute('CREATE STAGE')
+    cursor.execute('COPY INTO')
+
+    assert [r['query_id'] for r in query_stats_collector.records] == ['id of CREATE STAGE', 'id of COPY INTO']
+    assert connection.session_id == 123
+    assert cursor.rowcount == 1
+
+
+def test_report_passes_earliest_start_time_to_stats_source():
+    query_stats_collector.add(query_id='q1', client_seconds=1.0)
+    query_stats_collector.add(query_id='q2', client_seconds=60.0)  # started before q1
+    q1_start_time, q2_start_time = [r['start_time'] for r in query_stats_collector.records]
+    assert q2_start_time < q1_start_time - datetime.timedelta(seconds=50)
+    start_times = []
+
+    def stats_source(query_ids, start_time):
+        start_times.append(start_time)
+        return make_stats_source({})(query_ids, start_time)
+
+    log_query_report(logger, stats_source=stats_source)
+
+    assert start_times == [q2_start_time]
+
+
+def test_report_logs_client_timings_if_stats_source_fails(caplog):
+    query_stats_collector.add(query_id='q1', client_seconds=1.0)
+
+    def stats_source(query_ids, start_time):
+        raise RuntimeError('Insufficient privileges')
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        df = log_query_report(logger, stats_source=stats_source)
+
+    assert df['query_id'].tolist() == ['q1']
+    assert pd.isna(df.loc[0, 'execution_seconds'])
+    messages = [r.getMessage() for r in caplog.records]
+    assert any('Could not fetch server-side query statistics' in m and 'Insufficient privileges' in m
+               for m in messages)
+    assert any(m.startswith('Query q1') for m in messages)
+
+
+def test_report_keeps_queries_without_server_stats():
+    query_stats_collector.add(query_id='q1', client_seconds=1.0)
+    query_stats_collector.add(query_id='q2', client_seconds=1.0)
+
+    df = log_query_report(logger, stats_source=make_stats_source({'q1': {}}))
+
+    assert df['query_id'].tolist() == ['q1', 'q2']
+    assert df.loc[0, 'execution_seconds'] == 1.0
+    assert pd.isna(df.loc[1, 'execution_seconds'])
+    assert not df['is_outlier'].any()
+
+
+@pytest.mark.parametrize('client_seconds, stats, expected_reason', [
+    (100.0, {}, 'took more than 3.0x the median'),
+    (1.0, {'queued_seconds': 60.0}, 'was queued for more than 30.0s'),
+    (1.0, {'bytes_spilled_remote': 1024}, 'spilled to remote storage'),
+])
+def test_report_flags_outliers(caplog, client_seconds, stats, expected_reason):
+    query_stats_collector.add(query_id='q1', client_seconds=1.0)
+    query_stats_collector.add(query_id='q2', client_seconds=1.0)
+    query_stats_collector.add(query_id='q3', client_seconds=client_seconds)
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        df = log_query_report(logger, stats_source=make_stats_source({'q1': {}, 'q2': {}, 'q3': stats}))
+
+    assert df['is_outlier'].tolist() == [False, False, True]
+    warnings = [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert warnings[0].startswith('Query q3')
+    assert expected_reason in warnings[0]
+
+
+def test_report_does_not_flag_short_queries_above_median():
+    query_stats_collector.add(query_id='q1', client_seconds=0.1)
+    query_stats_collector.add(query_id='q2', client_seconds=0.1)
+    query_stats_collector.add(query_id='q3', client_seconds=5.0)  # 50x the median, but below min_outlier_seconds
+
+    df = log_query_report(logger, stats_source=make_stats_source({'q1': {}, 'q2': {}, 'q3': {}}))
+
+    assert not df['is_outlier'].any()
+
+
+def test_report_clears_collector():
+    query_stats_collector.add(query_id='q1', client_seconds=1.0)
+
+    log_query_report(logger, stats_source=make_stats_source({'q1': {}}), clear=False)
+    assert len(query_stats_collector.records) == 1
+
+    log_query_report(logger, stats_source=make_stats_source({'q1': {}}))
+    assert query_stats_collector.records == []
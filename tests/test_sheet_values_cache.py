@@ -0,0 +1,82 @@
+import os
+import pytest
+
+from datascience_batch_job_utils.sheets import SheetValuesCache
+
+
+VALUES = [['ASIN', 'Title'], ['B000000001', 'Title 1'], ['B000000002', 'Title 2']]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SheetValuesCache(cache_dir=tmp_path / 'sheets', max_bytes=1024 * 1024)
+
+
+def set_last_used(cache, spreadsheet_id, timestamp):
+    os.utime(cache.get_path(spreadsheet_id, 'A1:J'), (timestamp, timestamp))
+
+
+def test_get_returns_values_that_were_put(cache):
+    cache.put('id1', 'A1:J', revision='1', values=VALUES)
+
+    assert cache.get('id1', 'A1:J', revision='1') == VALUES
+
+
+def test_get_returns_none_without_entry(cache):
+    assert cache.get('id1', 'A1:J', revision='1') is None
+
+
+def test_get_is_keyed_by_range(cache):
+    cache.put('id1', 'A1:J', revision='1', values=VALUES)
+
+    assert cache.get('id1', 'A1:B', revision='1') is None
+
+
+def test_get_returns_none_after_revision_changed(cache):
+    cache.put('id1', 'A1:J', revision='1', values=VALUES)
+
+    assert cache.get('id1', 'A1:J', revision='2') is None
+
+
+def test_put_overwrites_entry(cache):
+    cache.put('id1', 'A1:J', revision='1', values=VALUES)
+    cache.put('id1', 'A1:J', revision='2', values=VALUES[:1])
+
+    assert cache.get('id1', 'A1:J', revision='2') == VALUES[:1]
+
+
+def test_corrupt_entry_is_removed(cache):
+    cache.put('id1', 'A1:J', revision='1', values=VALUES)
+    path = cache.get_path('id1', 'A1:J')
+    path.write_bytes(b'not gzip')
+
+    assert cache.get('id1', 'A1:J', revision='1') is None
+    assert not path.exists()
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.put('id1', 'A1:J', revision='1', values=VALUES)
+    entry_bytes = cache.get_path('id1', 'A1:J').stat().st_size
+    cache.max_bytes = int(2.5 * entry_bytes)  # room for two entries
+
+    cache.put('id2', 'A1:J', revision='1', values=VALUES)
+    set_last_used(cache, 'id1', 1_000_000)
+    set_last_used(cache, 'id2', 2_000_000)
+
+    # reading id1 makes id2 the least recently used entry
+    assert cache.get('id1', 'A1:J', revision='1') == VALUES
+    cache.put('id3', 'A1:J', revision='1', values=VALUES)
+
+    assert cache.get('id1', 'A1:J', revision='1') == VALUES
+    assert cache.get('id2', 'A1:J', revision='1') is None
+    assert cache.get('id3', 'A1:J', revision='1') == VALUES
+
+
+def test_clear_removes_all_entries(cache):
+    cache.put('id1', 'A1:J', revision='1', values=VALUES)
+    cache.put('id2', 'A1:J', revision='1', values=VALUES)
+
+    cache.clear()
+
+    assert list(cache.cache_dir.iterdir()) == []
+    assert cache.get('id1', 'A1:J', revision='1') is None
@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+import pyarrow as pa
+import pytest
+
+from datascience_batch_job_utils import connections
+from datascience_batch_job_utils.helpers import query_stats_collector
+
+
+class FakeCursor:
+    sfqid = 'q1'
+
+    def __init__(self, batches, description):
+        self.batches = batches
+        self.description = description
+
+    def execute(self, query):
+        pass
+
+    def fetch_arrow_batches(self):
+        yield from self.batches
+
+    def fetch_arrow_all(self):
+        return pa.concat_tables(self.batches) if self.batches else None
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def empty_collector():
+    query_stats_collector.clear()
+    yield
+    query_stats_collector.clear()
+
+
+def use_fake_results(monkeypatch, batches, description=None):
+    cursor = FakeCursor(batches, description or [SimpleNamespace(name='A')])
+    monkeypatch.setattr(connections, 'get_snowflake_connector_connection', lambda **kwargs: FakeConnection(cursor))
+
+
+def test_widen_integer_fields():
+    schema = pa.schema([('a', pa.int8()), ('b', pa.int32()), ('c', pa.string()), ('d', pa.float64())])
+
+    assert connections.widen_integer_fields(schema) == pa.schema([('a', pa.int64()), ('b', pa.int64()),
+                                                                  ('c', pa.string()), ('d', pa.float64())])
+
+
+def test_spill_widens_batches_with_different_integer_widths(monkeypatch, tmp_path):
+    num_rows = 100_000
+    batches = [pa.table({'A': pa.array([1] * num_rows, type=pa.int8())}),
+               pa.table({'A': pa.array([300] * num_rows, type=pa.int16())}),  # does not fit into int8
+               pa.table({'A': pa.array([None] * num_rows, type=pa.null())}),
+               ]
+    use_fake_results(monkeypatch, batches)
+
+    allocated_bytes = pa.total_allocated_bytes()
+    table = connections.snowflake_query_to_arrow('select', spill_to_disk=True, scratch_dir=tmp_path)
+
+    # zero-copy: columns are backed by the memory-mapped file, not by memory allocated by Arrow
+    assert pa.total_allocated_bytes() - allocated_bytes < num_rows
+    assert table.schema == pa.schema([('A', pa.int64())])
+    assert table.num_rows == 3 * num_rows
+    assert table.column('A').to_pylist() == [1] * num_rows + [300] * num_rows + [None] * num_rows
+    assert list(tmp_path.glob('*/*.arrow'))
+    assert [r['query_id'] for r in query_stats_collector.records] == ['q1']
+
+
+@pytest.mark.parametrize('spill_to_disk', [True, False])
+def test_empty_results_use_columns_from_cursor_description(monkeypatch, tmp_path, spill_to_disk):
+    use_fake_results(monkeypatch, [], description=[SimpleNamespace(name='ASIN'), SimpleNamespace(name='TITLE')])
+
+    table = connections.snowflake_query_to_arrow('select', spill_to_disk=spill_to_disk, scratch_dir=tmp_path)
+
+    assert table.num_rows == 0
+    assert table.column_names == ['ASIN', 'TITLE']